@@ -1,10 +1,15 @@
 import functools
-from random import choice, randrange
+from random import Random
 from itertools import count
 from copy import copy
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError, as_completed
 from time import sleep
 
 debug = True
+# how many layouts to generate (in parallel) and score before keeping the best one
+# 1 keeps the old behaviour of using the first layout we make
+layout_candidates = 1
 
 class RoomSize:
     def __init__(self, height: int, width: int):
@@ -31,7 +36,7 @@ class Room:
         self.name = room_name               # a name of the room
         self.size = room_size               # a room type object
         self.type = room_type               # either normal, starting, or final
-        self.position = position            # tuple room position
+        self.position = position            # tuple room position, upper left cell (x, y)
         self.connections = {}               # a dictionary of directions and room objects
         self.chores = []
         if chores:
@@ -66,6 +71,11 @@ class Room:
     def do_chore(self, chore_name):
         return self.chores.pop(chore_name)
 
+    def get_bounds(self):
+        # bounding box of the room on the grid as (left, top, right, bottom), inclusive
+        x, y = self.position
+        return x, y, x + self.size.width - 1, y + self.size.height - 1
+
     def get_str_connections(self, conn_dict):
         string_conn = {}
         for k, v in conn_dict.items():
@@ -81,7 +91,7 @@ class RoomGrid:
     # this will show where the neighbors are
     left, right, top, bottom = 0, 1, 2, 3
 
-    def __init__(self, debug=False):
+    def __init__(self, debug=False, seed=None):
         if debug:
             self.debug = True
             print("\nInitializing RoomGrid class...\n"
@@ -99,6 +109,13 @@ class RoomGrid:
         # each boolean is a direction, specified in the class variable section
         self.room_grid = [[self.new_space()]]
 
+        # seeded so the same seed always gives the same layout
+        self.rng = Random(seed)
+
+        # rooms already placed on the grid, in placement order
+        # each room keeps its own position so we can look rooms up by area
+        self.rooms = []
+
         # we would like rooms so that that are more likely to be closely clustered
         # do this will track where current rooms are placed
         # will be a list of coordinates
@@ -118,10 +135,10 @@ class RoomGrid:
         """
         print_str = ""
         for row in range(len(self.room_grid[0])):
-            for column in self.room_grid:
-                space = column[row]
-                if type(space) == Room:
-                    print_str += space.name[0] + " "
+            for c_index, column in enumerate(self.room_grid):
+                room = self.room_at(c_index, row)
+                if room:
+                    print_str += room.name[0] + " "
                 else:
                     print_str += str(sum(column[row])) + " "
             print_str += "\n"
@@ -130,11 +147,31 @@ class RoomGrid:
     def new_space(self):
         return [False, False, False, False]
 
+    # the grid itself is our per cell index, so finding a room by cell is a direct lookup
+    def room_at(self, x: int, y: int):
+        if 0 <= x < len(self.room_grid) and 0 <= y < len(self.room_grid[0]):
+            space = self.room_grid[x][y]
+            if type(space) == Room:
+                return space
+        return None
+
+    # find every placed room whose bounding box overlaps the given (inclusive) rectangle
+    def rooms_in_rect(self, left: int, top: int, right: int, bottom: int):
+        found = []
+        for room in self.rooms:
+            room_left, room_top, room_right, room_bottom = room.get_bounds()
+            if room_left <= right and left <= room_right and room_top <= bottom and top <= room_bottom:
+                found.append(room)
+        return found
+
     # grow grid functions will increase grid side in a direction when the game needs
     #   more space to place rooms or mark neighbors
     def grow_grid_up(self):
         for column in self.room_grid:
             column.insert(0, self.new_space())
+        # prepending a row moves every placed room down one
+        for room in self.rooms:
+            room.position = (room.position[0], room.position[1] + 1)
 
     def grow_grid_down(self):
         for column in self.room_grid:
@@ -145,6 +182,9 @@ class RoomGrid:
 
     def grow_grid_left(self):
         self.room_grid.insert(0, [self.new_space() for space in range(len(self.room_grid[0]))])
+        # prepending a column moves every placed room right one
+        for room in self.rooms:
+            room.position = (room.position[0] + 1, room.position[1])
 
     # here we are marking a space in a direction, to let them know a adjacent room exists
     # so we mark a space on top of the room with a "bottom neighbor"
@@ -195,17 +235,9 @@ class RoomGrid:
     def confirm_placement_zone(self, space: list, direction: int, size: RoomSize):
         free = True
         if direction == 4:
-            for w_unit in range(size.width):
-                for h_unit in range(size.height):
-                    # if space is outside of grid it is free
-                    if w_unit + space[0] > len(self.room_grid) - 1:
-                        continue
-                    if h_unit + space[1] > len(self.room_grid[0]) - 1:
-                        continue
-                    # if space is not a room it is free
-                    if type(self.room_grid[w_unit + space[0]][h_unit + space[1]]) == Room:
-                        free = False
-                        break
+            # spaces outside of the grid are free, so only rooms inside the zone block it
+            if self.rooms_in_rect(space[0], space[1], space[0] + size.width - 1, space[1] + size.height - 1):
+                free = False
         else:
             free = False
 
@@ -246,7 +278,7 @@ class RoomGrid:
             spot_found = False
             while len(tmp_heat_map) > 0 and not spot_found:
                 # pick a random space, weighted for multiple neighbors
-                chosen_space = tmp_heat_map.pop(randrange(len(tmp_heat_map)))
+                chosen_space = tmp_heat_map.pop(self.rng.randrange(len(tmp_heat_map)))
                 if self.debug: print("Candidate Space:", chosen_space, end=" -- ")
 
                 # if the room larger than size (1,1) we need to make sure the whole room fits
@@ -300,6 +332,9 @@ class RoomGrid:
                 space_adjustment, neighbors = self.place_neighbors(space=[this_space_x, this_space_y], this_room=room)
                 space = [space[0] + space_adjustment[0], space[1] + space_adjustment[1]]
                 total_neighbors.update(neighbors)
+        # space has followed any grid growth, so it is now the room's upper left cell
+        room.position = (space[0], space[1])
+        self.rooms.append(room)
         # Once the room is placed and the neighbors are marked we need to update the placement list
         self.update_grid_heat_map()
 
@@ -403,7 +438,8 @@ class RoomGrid:
 
 class Game:
 
-    def __init__(self, room_size_pool: dict, room_chore_pool: dict, num_rooms=None, debug=False):
+    def __init__(self, room_size_pool: dict, room_chore_pool: dict, num_rooms=None, seed=None,
+                 layout_candidates=1, layout_budget=None, layout_threshold=None, debug=False):
         print("\nWelcome to a text based adventure game!\n"
               "Starting game Setup:\n")
         if debug:
@@ -422,8 +458,16 @@ class Game:
         self.room_pool = []
         self.room_grid: RoomGrid
         self.num_rooms = num_rooms
-        self.room_size_pool = room_size_pool
-        self.room_chore_pool = room_chore_pool
+        # compile the pools once into fixed arrays; map generation picks indices
+        # into these so the caller's pools are never copied or used up
+        self.room_sizes = tuple(room_size_pool.values())
+        self.room_names = tuple(room_chore_pool.keys())
+        self.room_chores = tuple(room_chore_pool.values())
+        self.rng = Random(seed)
+        # layout search settings, see search_layouts
+        self.layout_candidates = layout_candidates
+        self.layout_budget = layout_budget
+        self.layout_threshold = layout_threshold
         self.initialized_chores = []
         self.collected_chores = []
         self.all_objectives_completed = False
@@ -446,26 +490,39 @@ class Game:
             if num_rooms < 3:
                 print("Need atleast 3 rooms to play!")
                 continue
-            elif num_rooms > len(self.room_chore_pool) + 2:
+            elif num_rooms > len(self.room_names) + 2:
                 print("You can't have more rooms that your room pool + 2")
                 continue
             else:
                 self.num_rooms = num_rooms
         self.room_pool = []
         # form new rooms from our list of possible room sizes and chores
-        self.make_rooms(self.room_size_pool, self.room_chore_pool)
-        # place each of our new rooms on the grid to form our play area
-        for this_room in self.room_pool:
-            self.room_grid.place_room(this_room)
+        self.make_rooms()
+        if self.layout_candidates > 1:
+            # build several layouts at once and keep the best scoring one
+            self.room_grid = search_layouts(self.room_pool, self.layout_candidates, budget=self.layout_budget,
+                                            threshold=self.layout_threshold, seed=self.rng.getrandbits(32))
+            # the winning layout was built from copies of our rooms, so use its rooms from now on
+            self.room_pool = self.room_grid.rooms
+            self.starting_room = self.room_pool[0]
+            self.final_room = self.room_pool[-1]
+            if self.debug: print("Best layout score:", score_layout(self.room_grid))
+            if self.debug: print(self.room_grid)
+        else:
+            self.room_grid = RoomGrid(debug=self.debug, seed=self.rng.getrandbits(32))
+            # place each of our new rooms on the grid to form our play area
+            for this_room in self.room_pool:
+                self.room_grid.place_room(this_room)
         if self.debug: [print("---------------------------", x) for x in self.room_pool]
         if self.debug: print("---------------------------")
 
-    def make_rooms(self, room_sizes: dict, chore_pool: dict):
+    def make_rooms(self):
         # # form new rooms from our list of possible room sizes and chores
-        self.room_grid = RoomGrid(debug=self.debug)
         self.initialized_chores = []
+        # pick a distinct chore room for every normal room without touching the pool
+        chore_indices = iter(self.rng.sample(range(len(self.room_names)), self.num_rooms - 2))
         for room in range(self.num_rooms):
-            room_size = choice(list(room_sizes.values()))
+            room_size = self.rng.choice(self.room_sizes)
             # first room is our starting area
             if room == 0:
                 room_type = RoomType("starting")
@@ -479,11 +536,11 @@ class Game:
             # Every other room is a normal room with a chore
             else:
                 room_type = RoomType("normal")
-                name = choice(list(chore_pool.keys()))
-                chore = chore_pool[name]
-                del chore_pool[name]
+                chore_index = next(chore_indices)
+                name = self.room_names[chore_index]
+                chore = self.room_chores[chore_index]
                 self.initialized_chores.append(chore)
-            new_room = Room(room_name=name, room_size=room_size, position=(0, 0), chores=chore, room_type=room_type)
+            new_room = Room(room_name=name, room_size=room_size, chores=chore, room_type=room_type)
             # mark our starting and final rooms so the game knows where to start and end
             if room == 0:
                 self.starting_room = new_room
@@ -528,7 +585,8 @@ class Game:
                     room_name_hint = ""
                 print("- {} {}".format(direction, room_name_hint))
 
-    def get_doors(self, room: Room):
+    @staticmethod
+    def get_doors(room: Room):
         # return a dictionary of directions to walk in
         door_list = {}
         for k, v in sorted(room.connections.items()):
@@ -700,6 +758,75 @@ class Game:
                 print("bad input, enter 'y' or 'n'")
 
 
+def build_layout(rooms: list, seed: int):
+    # place the rooms on a fresh grid and score the result
+    # runs in a worker process, so the rooms here are copies of the game's rooms
+    room_grid = RoomGrid(seed=seed)
+    for room in rooms:
+        room_grid.place_room(room)
+    return room_grid, score_layout(room_grid)
+
+
+def score_layout(room_grid: RoomGrid):
+    # each part of the score is between 0 and 1, higher is better
+    rooms = room_grid.rooms
+    bounds = [room.get_bounds() for room in rooms]
+    # compactness: how much of the area the layout spans is actually rooms
+    width = max(b[2] for b in bounds) - min(b[0] for b in bounds) + 1
+    height = max(b[3] for b in bounds) - min(b[1] for b in bounds) + 1
+    room_cells = sum(room.size.width * room.size.height for room in rooms)
+    compactness = room_cells / (width * height)
+
+    # connectivity: how many directions you can walk out of a room
+    # door count: how many doors each room has, capped at one per direction
+    all_doors = [Game.get_doors(room) for room in rooms]
+    connectivity = sum(len(doors) for doors in all_doors) / (4 * len(rooms))
+    door_count = sum(min(sum(len(d) for d in doors.values()) / 4, 1) for doors in all_doors) / len(rooms)
+
+    # route length: average number of rooms walked from the start to reach every other room
+    distances = {rooms[0]: 0}
+    queue = deque([rooms[0]])
+    while queue:
+        room = queue.popleft()
+        for neighbor in room.connections:
+            if neighbor not in distances:
+                distances[neighbor] = distances[room] + 1
+                queue.append(neighbor)
+    average_distance = sum(distances.values()) / max(len(distances) - 1, 1)
+    route = 1 / max(average_distance, 1)
+
+    return compactness + connectivity + door_count + route
+
+
+def search_layouts(rooms: list, candidates: int, budget=None, threshold=None, seed=None):
+    # Generate a number of candidate layouts across a process pool and return the best grid.
+    # budget: seconds to wait for candidates before taking the best one found so far
+    # threshold: stop as soon as a layout scores at least this much (max score is 4)
+    rng = Random(seed)
+    seeds = [rng.getrandbits(32) for candidate in range(candidates)]
+    best_grid, best_score = None, None
+    executor = ProcessPoolExecutor()
+    try:
+        futures = [executor.submit(build_layout, rooms, candidate_seed) for candidate_seed in seeds]
+        try:
+            for future in as_completed(futures, timeout=budget):
+                room_grid, score = future.result()
+                if best_score is None or score > best_score:
+                    best_grid, best_score = room_grid, score
+                if threshold is not None and score >= threshold:
+                    break
+        except TimeoutError:
+            pass
+    finally:
+        # don't wait on layouts we no longer need
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    # if the budget ran out before any candidate finished, build one here
+    if best_grid is None:
+        best_grid, best_score = build_layout(rooms, seeds[0])
+    return best_grid
+
+
 room_size_pool = {
     "small_room": RoomSize(1, 1),
     "tall_room": RoomSize(2, 1),
@@ -717,6 +844,8 @@ room_chore_pool = {
     "office": "go sharpen the pencils"
 }
 
-Game(room_size_pool=room_size_pool, room_chore_pool=room_chore_pool, debug=debug)
+if __name__ == "__main__":
+    Game(room_size_pool=room_size_pool, room_chore_pool=room_chore_pool,
+         layout_candidates=layout_candidates, debug=debug)
 
 